@@ -1,16 +1,29 @@
 #! /usr/bin/env python3
 
+import re
+import numpy as np
 import rospy
 import smach
-from hsrb_interface import Robot
 from std_srvs.srv import Empty
-from geometry_msgs.msg import PoseStamped
-from vision_msgs.msg import BoundingBox3D
+from geometry_msgs.msg import Pose, Point, Quaternion
 from v4r_util.conversions import vector3_to_list
 from moveit_wrapper import MoveitWrapper
 from v4r_util.tf2 import TF2Wrapper
 
 
+# Obstacles that are added once, centered on the robot base in the map frame.
+# (name, offset_x, offset_y, center_z, size_x, size_y, size_z)
+STATIC_OBSTACLES = [
+    # Floor plane to filter weird octomap points in floor that prevent the robot from moving because of 'collisions' with the floor
+    ('floor', 0, 0, -0.07, 15, 15, 0.1),
+]
+
+# Tables are only added if their center lies in a grid cell close to the cell of the robot base.
+# Cell size in meters and maximum Manhattan distance in cells.
+TABLE_GRID_SIZE = 0.5
+TABLE_GRID_RADIUS = 2
+
+
 class CollisionEnvironment(smach.State):
     def __init__(self):
         smach.State.__init__(
@@ -19,37 +32,72 @@ class CollisionEnvironment(smach.State):
         self.moveit_wrapper = MoveitWrapper(self.tf_wrapper)
         self.moveit_wrapper.detach_all_objects()
         self.clear_octomap = rospy.ServiceProxy('/clear_octomap', Empty)
-        self.add_floor_plane()
+        # Tables left in the planning scene by a previous run are removed with the first execution
+        self.table_names = [name for name in self.moveit_wrapper.get_objects()
+                            if name == 'table' or re.fullmatch(r'table_\d+', name)]
+        self.add_static_obstacles()
         # Remove floor fragments from previous octomap
         self.clear_octomap()
         rospy.loginfo('CollEnv init')
     
-    def add_floor_plane(self):
-        # Add floor plane to filter weird octomap points in floor that prevent the robot from moving because of 'collisions' with the floor
+    def add_static_obstacles(self):
         base_pose = self.moveit_wrapper.get_current_pose('map')
 
         pos = base_pose.pose.position
         ori = base_pose.pose.orientation
 
-        floor = BoundingBox3D()
-        floor.center.position.x = pos.x
-        floor.center.position.y = pos.y
-        floor.center.position.z = -0.07
-        floor.center.orientation.w = ori.w
-
-        size = [15, 15, 0.1]
-
-        self.moveit_wrapper.add_box('floor', 'map', floor.center, size)
+        collision_objects = [
+            self.moveit_wrapper.make_box(
+                name, 'map', Pose(position=Point(x=pos.x + dx, y=pos.y + dy, z=z), orientation=Quaternion(w=ori.w)),
+                [size_x, size_y, size_z])
+            for name, dx, dy, z, size_x, size_y, size_z in STATIC_OBSTACLES]
+        if not self.moveit_wrapper.apply_scene_diff(collision_objects):
+            rospy.logerr('CollEnv: Adding static obstacles to the planning scene failed')
 
     def execute(self, userdata):
-        self.moveit_wrapper.detach_all_objects()
         grasp_obj_bb = userdata.grasp_object_bb
-        table_bb = userdata.table_bbs.boxes[0]
-        self.moveit_wrapper.add_box('object', grasp_obj_bb.header.frame_id, grasp_obj_bb.center, vector3_to_list(grasp_obj_bb.size))
-        rospy.sleep(0.1)
-        self.moveit_wrapper.add_box('table', userdata.table_bbs.header.frame_id, table_bb.center, vector3_to_list(table_bb.size))
+        object_box = self.moveit_wrapper.make_box(
+            'object', grasp_obj_bb.header.frame_id, grasp_obj_bb.center, vector3_to_list(grasp_obj_bb.size))
+        # Detaching the previous object, adding object and tables and removing old tables is done with a single
+        # planning scene diff. MoveIt applies the detach before the world changes, so the new object replaces the old one.
+        if not self.moveit_wrapper.apply_scene_diff(
+                collision_objects=[object_box] + self.get_table_collision_objects(userdata.table_bbs),
+                attached_collision_objects=[self.moveit_wrapper.make_detach()]):
+            rospy.logerr('CollEnv: Updating object and tables in the planning scene failed')
 
         userdata.grasp_object_name_moveit = 'object'
         
         return 'succeeded'
 
+    def get_table_collision_objects(self, table_bbs):
+        '''Creates boxes for the detected tables close to the robot, so that MoveIt can check them as primitive shapes
+        instead of relying on the octomap for them. The first table keeps the name 'table'.
+        Tables of previous executions that are not added again are removed.
+        table_bbs: vision_msgs/BoundingBox3DArray
+        Returns: list of moveit_msgs/CollisionObject
+        '''
+        table_indices = self.get_tables_near_base(table_bbs)
+        table_names = ['table' if i == 0 else f'table_{i}' for i in table_indices]
+        table_boxes = [self.moveit_wrapper.make_box(name, table_bbs.header.frame_id, table_bbs.boxes[i].center,
+                                                    vector3_to_list(table_bbs.boxes[i].size))
+                       for name, i in zip(table_names, table_indices)]
+        removed_tables = [self.moveit_wrapper.make_remove(name) for name in self.table_names if name not in table_names]
+        self.table_names = table_names
+        return table_boxes + removed_tables
+
+    def get_tables_near_base(self, table_bbs):
+        '''Grid based broad phase: bins the table centers into TABLE_GRID_SIZE cells and keeps the tables
+        whose cell is at most TABLE_GRID_RADIUS cells (Manhattan distance) away from the cell of the robot base.
+        The first table is always kept, as it is the table the object is standing on.
+        table_bbs: vision_msgs/BoundingBox3DArray
+        Returns: indices of the tables to keep
+        '''
+        if len(table_bbs.boxes) == 0:
+            return []
+        base_pos = self.moveit_wrapper.get_current_pose(table_bbs.header.frame_id).pose.position
+        base_cell = np.floor(np.array([base_pos.x, base_pos.y]) / TABLE_GRID_SIZE).astype(int)
+        centers = np.array([[bb.center.position.x, bb.center.position.y] for bb in table_bbs.boxes])
+        cells = np.floor(centers / TABLE_GRID_SIZE).astype(int)
+        is_near = np.abs(cells - base_cell).sum(axis=1) <= TABLE_GRID_RADIUS
+        is_near[0] = True
+        return np.flatnonzero(is_near)
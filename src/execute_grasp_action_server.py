@@ -2,7 +2,7 @@
 
 
 import copy
-from math import pi
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import rospy
 import actionlib
@@ -13,7 +13,8 @@ from v4r_util.util import align_pose_rotation, get_best_aligning_axis, Axis, rot
 from v4r_util.conversions import ros_pose_to_np_transform, np_transform_to_ros_pose
 from moveit_wrapper import MoveitWrapper
 from hsr_wrapper import HSR_wrapper
-from geometry_msgs.msg import Pose, PoseStamped, Transform
+from marker_utils import approach_arrow_orientation
+from geometry_msgs.msg import Pose, PoseStamped, Transform, Point, Quaternion
 from visualization_msgs.msg import Marker
 from grasping_pipeline_msgs.msg import ExecuteGraspAction, ExecuteGraspResult
 
@@ -24,7 +25,13 @@ class ExecuteGraspServer:
         rospy.loginfo("Execute grasp: Waiting for moveit")
         self.moveit_wrapper = MoveitWrapper(self.tf_wrapper)
         rospy.loginfo("Execute grasp: Got Moveit")
+        # Links that may touch the grasped object, they don't change
+        self.touch_links = self.moveit_wrapper.get_link_names(group='gripper')
         self.hsr_wrapper = HSR_wrapper()
+        # Closes the gripper in the background, see execute
+        self.gripper_executor = ThreadPoolExecutor(max_workers=1)
+        self.tf_broadcaster = tf.TransformBroadcaster()
+        self.marker_pub = rospy.Publisher('/grasp_marker_2', Marker, queue_size=10, latch=True)
         
         self.server = actionlib.SimpleActionServer(
             'execute_grasp', ExecuteGraspAction, self.execute, False)
@@ -37,22 +44,9 @@ class ExecuteGraspServer:
         # hrisi experiments, change back to 0.1 again afterwards
         safety_distance = rospy.get_param("/safety_distance", default=0.2)
 
-        for grasp_pose in goal.grasp_poses:
-            # assumes static scene, i.e robot didn't move since grasp pose was found
-            grasp_pose.header.stamp = rospy.Time.now()
-            grasp_pose = self.tf_wrapper.transform_pose(planning_frame, grasp_pose)
-        
-            approach_pose = copy.deepcopy(grasp_pose)
-            q = [grasp_pose.pose.orientation.x, grasp_pose.pose.orientation.y,
-                 grasp_pose.pose.orientation.z, grasp_pose.pose.orientation.w]
-            approach_vector = qv_mult(q, [0, 0, -1])
-            approach_pose.pose.position.x = approach_pose.pose.position.x + \
-                safety_distance * approach_vector[0] 
-            approach_pose.pose.position.y = approach_pose.pose.position.y + \
-                safety_distance * approach_vector[1] 
-            approach_pose.pose.position.z = approach_pose.pose.position.z + \
-                safety_distance * approach_vector[2]
+        approach_poses = self.get_approach_poses(goal.grasp_poses, planning_frame, safety_distance)
 
+        for approach_pose in approach_poses:
             plan_found = self.moveit_wrapper.whole_body_plan_and_go(approach_pose)
             if not plan_found:
                 rospy.logdebug("Execute grasp: No plan found, Trying next grasp pose")
@@ -64,14 +58,17 @@ class ExecuteGraspServer:
                 continue
             
             self.hsr_wrapper.move_eef_by_line((0, 0, 1), safety_distance)
-            rospy.sleep(0.1)
-                
-            self.hsr_wrapper.gripper_grasp_hsr(0.3)
+
+            # The wrist doesn't move while the gripper closes, so the wrist to object transform
+            # can be computed while waiting for the gripper
+            grasp_future = self.gripper_executor.submit(self.hsr_wrapper.gripper_grasp_hsr, 0.3)
             transform = self.get_transform_from_wrist_to_object_bottom_plane(goal, planning_frame)
             res.placement_surface_to_wrist = transform
+            # Reraises exceptions of the gripper, so that they still abort the goal
+            grasp_future.result()
             
-            touch_links = self.moveit_wrapper.get_link_names(group='gripper')
-            self.moveit_wrapper.attach_object(goal.grasp_object_name_moveit, touch_links)
+            if not self.moveit_wrapper.attach_object(goal.grasp_object_name_moveit, self.touch_links):
+                rospy.logerr(f"Execute grasp: Attaching {goal.grasp_object_name_moveit} to the gripper failed")
 
             # Move the object up to avoid collision with the table
             self.hsr_wrapper.move_eef_by_delta((0, 0, 0.05))
@@ -93,6 +90,53 @@ class ExecuteGraspServer:
         rospy.logerr("Grasping failed")
         self.server.set_aborted(res)
 
+    def get_approach_poses(self, grasp_poses, target_frame, safety_distance):
+        '''Transforms all grasp poses into the target frame and moves them back along their
+        approach vector by the safety distance.
+        All poses are processed at once as (N,3) position and (N,4) quaternion arrays and the
+        transform is only looked up once per source frame instead of once per grasp pose.
+        Assumes static scene, i.e robot didn't move since grasp pose was found.
+        grasp_poses: list of geometry_msgs/PoseStamped
+        target_frame: str, frame to transform to
+        safety_distance: float, distance between grasp pose and approach pose in meters
+        Returns: list of geometry_msgs/PoseStamped
+        '''
+        if len(grasp_poses) == 0:
+            return []
+        pos = np.array([[p.pose.position.x, p.pose.position.y, p.pose.position.z]
+                        for p in grasp_poses])
+        quat = np.array([[p.pose.orientation.x, p.pose.orientation.y, p.pose.orientation.z, p.pose.orientation.w]
+                         for p in grasp_poses])
+        frame_ids = np.array([p.header.frame_id for p in grasp_poses])
+
+        for frame_id in set(frame_ids):
+            # The origin of the source frame in the target frame is the transform between them
+            origin = PoseStamped()
+            origin.header.frame_id = frame_id
+            origin.header.stamp = rospy.Time(0)
+            origin.pose.orientation.w = 1.0
+            transform = self.tf_wrapper.transform_pose(target_frame, origin).pose
+            rot_quat = np.array([transform.orientation.x, transform.orientation.y,
+                                 transform.orientation.z, transform.orientation.w])
+            transl = np.array([transform.position.x, transform.position.y, transform.position.z])
+            rot_mat = tf.transformations.quaternion_matrix(rot_quat)[:3, :3]
+            mask = frame_ids == frame_id
+            pos[mask] = pos[mask] @ rot_mat.T + transl
+            quat[mask] = qq_mult(rot_quat, quat[mask])
+
+        pos = pos + safety_distance * qv_mult(quat, [0, 0, -1])
+
+        stamp = rospy.Time.now()
+        approach_poses = []
+        for p, q in zip(pos, quat):
+            approach_pose = PoseStamped()
+            approach_pose.header.frame_id = target_frame
+            approach_pose.header.stamp = stamp
+            approach_pose.pose.position = Point(*p)
+            approach_pose.pose.orientation = Quaternion(*q)
+            approach_poses.append(approach_pose)
+        return approach_poses
+
     def get_transform_from_wrist_to_object_bottom_plane(self, goal, planning_frame):
         object_poses = self.moveit_wrapper.get_object_poses([goal.grasp_object_name_moveit])
         object_pose = object_poses[goal.grasp_object_name_moveit]
@@ -156,16 +200,14 @@ class ExecuteGraspServer:
             pose_goal {geometry_msgs.msg.PoseStamped} -- pose for the grasp marker
         """
         rospy.logerr(f"{id = }, {r = }, {g = }, {b = }")
-        br = tf.TransformBroadcaster()
-        br.sendTransform((pose_goal.pose.position.x, pose_goal.pose.position.y, pose_goal.pose.position.z),
-                         [pose_goal.pose.orientation.x, pose_goal.pose.orientation.y,
-                             pose_goal.pose.orientation.z, pose_goal.pose.orientation.w],
-                         rospy.Time.now(),
-                         'grasp_pose_execute',
-                         pose_goal.header.frame_id)
-
-        marker_pub = rospy.Publisher(
-            '/grasp_marker_2', Marker, queue_size=10, latch=True)
+        self.tf_broadcaster.sendTransform(
+            (pose_goal.pose.position.x, pose_goal.pose.position.y, pose_goal.pose.position.z),
+            [pose_goal.pose.orientation.x, pose_goal.pose.orientation.y,
+                pose_goal.pose.orientation.z, pose_goal.pose.orientation.w],
+            rospy.Time.now(),
+            'grasp_pose_execute',
+            pose_goal.header.frame_id)
+
         marker = Marker()
         marker.header.frame_id = pose_goal.header.frame_id
         marker.header.stamp = rospy.Time()
@@ -175,15 +217,7 @@ class ExecuteGraspServer:
         marker.type = Marker.ARROW
         marker.action = Marker.ADD
 
-        q2 = [pose_goal.pose.orientation.w, pose_goal.pose.orientation.x,
-              pose_goal.pose.orientation.y, pose_goal.pose.orientation.z]
-        q = tf.transformations.quaternion_about_axis(pi / 2, (0, 1, 0))
-        q = tf.transformations.quaternion_multiply(q, q2)
-
-        marker.pose.orientation.w = q[0]
-        marker.pose.orientation.x = q[1]
-        marker.pose.orientation.y = q[2]
-        marker.pose.orientation.z = q[3]
+        marker.pose.orientation = approach_arrow_orientation(pose_goal.pose.orientation)
         marker.pose.position.x = pose_goal.pose.position.x
         marker.pose.position.y = pose_goal.pose.position.y
         marker.pose.position.z = pose_goal.pose.position.z
@@ -196,22 +230,48 @@ class ExecuteGraspServer:
         marker.color.r = r
         marker.color.g = g
         marker.color.b = b
-        marker_pub.publish(marker)
+        self.marker_pub.publish(marker)
         rospy.loginfo('grasp_marker')
 
 
 def qv_mult(q, v):
     """ Rotating the vector v by quaternion q
+    Uses the closed form v + w*t + q_xyz x t with t = 2 * q_xyz x v,
+    which avoids building the full rotation matrix.
+    Broadcasts over leading dimensions, e.g. q of shape (N, 4) rotates v for all N quaternions.
     Arguments:
-        q {list of float} -- Quaternion w,x,y,z
+        q {list of float} -- Quaternion x,y,z,w
         v {list} -- Vector x,y,z
 
     Returns:
         numpy array -- rotated vector
     """
-    rot_mat = tf.transformations.quaternion_matrix(q)[:3, :3]
-    v = np.array(v)
-    return rot_mat.dot(v)
+    x, y, z, w = np.moveaxis(np.asarray(q, dtype=float), -1, 0)
+    vx, vy, vz = np.moveaxis(np.asarray(v, dtype=float), -1, 0)
+    tx = 2 * (y * vz - z * vy)
+    ty = 2 * (z * vx - x * vz)
+    tz = 2 * (x * vy - y * vx)
+    return np.stack([vx + w * tx + (y * tz - z * ty),
+                     vy + w * ty + (z * tx - x * tz),
+                     vz + w * tz + (x * ty - y * tx)], axis=-1)
+
+
+def qq_mult(q1, q2):
+    """ Hamilton product q1 * q2
+    Broadcasts over leading dimensions like qv_mult.
+    Arguments:
+        q1 {list of float} -- Quaternion x,y,z,w
+        q2 {list of float} -- Quaternion x,y,z,w
+
+    Returns:
+        numpy array -- Quaternion x,y,z,w
+    """
+    x1, y1, z1, w1 = np.moveaxis(np.asarray(q1, dtype=float), -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(np.asarray(q2, dtype=float), -1, 0)
+    return np.stack([w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                     w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2], axis=-1)
 
 
 if __name__ == '__main__':
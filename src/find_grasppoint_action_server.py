@@ -5,7 +5,6 @@ from copy import deepcopy
 import numpy as np
 import yaml
 from yaml.loader import SafeLoader
-from math import pi
 import message_filters
 from sensor_msgs.msg import Image, CameraInfo
 from v4r_util.depth_pcd import convert_ros_depth_img_to_pcd
@@ -17,8 +16,7 @@ import rospy
 from grasping_pipeline_msgs.msg import (FindGrasppointAction,
                                    FindGrasppointResult)
 from object_detector_msgs.srv import VisualizePoseEstimationRequest, VisualizePoseEstimation
-from tf.transformations import (quaternion_about_axis, quaternion_from_matrix,
-                                quaternion_multiply)
+from tf.transformations import quaternion_from_matrix
 from tf_conversions import posemath
 from visualization_msgs.msg import Marker
 from robokudo_msgs.msg import GenericImgProcAnnotatorAction, GenericImgProcAnnotatorGoal
@@ -26,6 +24,7 @@ from sensor_msgs.msg import RegionOfInterest
 from geometry_msgs.msg import Pose, Point, Quaternion
 
 from grasp_checker import check_grasp_hsr
+from marker_utils import approach_arrow_orientation
 from v4r_util.util import get_minimum_oriented_bounding_box, o3d_bb_to_ros_bb_stamped, create_ros_bb_stamped
 
 class FindGrasppointServer:
@@ -91,7 +90,13 @@ class FindGrasppointServer:
         rgb = self.rgb
         depth = self.depth
         estimator_goal = GenericImgProcAnnotatorGoal(rgb = rgb, depth = depth)
-        estimator_result = self.get_estimator_result(estimator_goal)
+        self.send_estimator_goal(estimator_goal)
+        # The scene cloud doesn't depend on the estimator result, so compute it while the estimator is running
+        scene_cloud, scene_cloud_o3d = convert_ros_depth_img_to_pcd(
+            depth, 
+            self.cam_info, 
+            project_valid_depth_only=False)
+        estimator_result = self.wait_for_estimator_result()
         self.visualize_pose_estimation_result(
             rgb, 
             estimator_result.pose_results, 
@@ -102,11 +107,6 @@ class FindGrasppointServer:
             rospy.logdebug('Performing consistency checks')
             self.perform_estimator_results_consistency_checks(estimator_result)
 
-            scene_cloud, scene_cloud_o3d = convert_ros_depth_img_to_pcd(
-                depth, 
-                self.cam_info, 
-                project_valid_depth_only=False)
-
             if 'Unknown' in estimator_result.class_names:
                 # We expect label image values to be in the same order as the lists for class_confidence, class_names, ...
                 bbs, ROI_2d, poses = self.prepare_unknown_object_detection(estimator_result, scene_cloud_o3d)
@@ -267,10 +267,11 @@ class FindGrasppointServer:
             poses.append(pose)
         return o3d_bbs, ROI_2d, poses
     
-    def get_estimator_result(self, estimator_goal):
+    def send_estimator_goal(self, estimator_goal):
         rospy.logdebug('Sending goal to estimator')
         self.pose_estimator.send_goal(estimator_goal)
 
+    def wait_for_estimator_result(self):
         rospy.logdebug('Waiting for estimator results')
         goal_finished = self.pose_estimator.wait_for_result(rospy.Duration(self.timeout))
         if not goal_finished:
@@ -361,15 +362,7 @@ class FindGrasppointServer:
         marker.type = Marker.ARROW
         marker.action = Marker.ADD
 
-        q2 = [pose_goal.pose.orientation.w, pose_goal.pose.orientation.x,
-              pose_goal.pose.orientation.y, pose_goal.pose.orientation.z]
-        q = quaternion_about_axis(pi / 2, (0, 1, 0))
-        q = quaternion_multiply(q, q2)
-
-        marker.pose.orientation.w = q[0]
-        marker.pose.orientation.x = q[1]
-        marker.pose.orientation.y = q[2]
-        marker.pose.orientation.z = q[3]
+        marker.pose.orientation = approach_arrow_orientation(pose_goal.pose.orientation)
         marker.pose.position.x = pose_goal.pose.position.x
         marker.pose.position.y = pose_goal.pose.position.y
         marker.pose.position.z = pose_goal.pose.position.z
@@ -1,6 +1,5 @@
 import numpy as np
 import open3d as o3d
-import copy
 import os
 
 REACHABLE_TOLERANCE = 0.1  # 0.05
@@ -14,6 +13,7 @@ class GraspChecker:
         gripper_cloud_file = os.path.join(
             self.dir_path, os.pardir, 'config', 'hsrb_hand.pcd')
         self.gripper_cloud = o3d.io.read_point_cloud(gripper_cloud_file)
+        self.gripper_points = np.asarray(self.gripper_cloud.points)
         self.scene_cloud = None
 
     def set_scene_data(self, scene_cloud):
@@ -102,10 +102,8 @@ class GraspChecker:
             True if the grasp pose is not in collision with the scene and table, false otherwise
         """
 
-        # Transform the gripper
-        gripper_cloud = copy.deepcopy(self.gripper_cloud)
-        gripper_cloud.transform(grasp_pose)
-        gripper_points = np.asarray(gripper_cloud.points)
+        # Transform the gripper points directly instead of cloning the whole Open3D point cloud
+        gripper_points = self.gripper_points @ grasp_pose[:3, :3].T + grasp_pose[:3, 3]
 
         # Find if any gripper point is within a threshold to the table plane
         if table_plane is None:
@@ -175,7 +173,7 @@ class GraspChecker:
         geometries.append(
             o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.5))
         for i in range(len(grasp_poses)):
-            g_cloud = copy.deepcopy(self.gripper_cloud)
+            g_cloud = o3d.geometry.PointCloud(self.gripper_cloud)
             g_cloud.transform(grasp_poses[i])
             if successes[i]:
                 g_cloud.paint_uniform_color([0, 1, 0])
@@ -193,11 +191,25 @@ class GraspChecker:
         return dist/e
 
 
+_tf_buffer = None
+_tf_listener = None
+
+
+def get_tf_buffer():
+    # One buffer and listener for all lookups. A listener that is created per lookup is never shut down
+    # and keeps receiving and deserializing every /tf message in its own thread.
+    global _tf_buffer, _tf_listener
+    import tf2_ros
+    if _tf_buffer is None:
+        _tf_buffer = tf2_ros.Buffer()
+        _tf_listener = tf2_ros.TransformListener(_tf_buffer)
+    return _tf_buffer
+
+
 def get_tf_transform(origin_frame, target_frame):
     import tf2_ros
     import rospy
-    tfBuffer = tf2_ros.Buffer()
-    listener = tf2_ros.TransformListener(tfBuffer)
+    tfBuffer = get_tf_buffer()
     tf_found = False
     while not tf_found:
         try:
@@ -242,7 +254,6 @@ def check_grasp_hsr(pose_odm, scene_cloud_ros, name=None, table_plane=None, visu
         List of valid grasp poses
     """
     from open3d_ros_helper import open3d_ros_helper as orh
-    import tf2_ros
     import tf
     import transforms3d as tf3d
     import rospy
@@ -357,7 +368,7 @@ def check_grasp_hsr(pose_odm, scene_cloud_ros, name=None, table_plane=None, visu
             o3d.geometry.TriangleMesh.create_coordinate_frame(size=0.5))
         combined_grasps = o3d.geometry.PointCloud()
         for i in range(len(grasp_poses)):
-            g_cloud = copy.deepcopy(grasp_checker.gripper_cloud)
+            g_cloud = o3d.geometry.PointCloud(grasp_checker.gripper_cloud)
             g_cloud.transform(grasp_poses[i])
             g_cloud.transform(object_pose)
             if successes[i]:
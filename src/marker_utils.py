@@ -0,0 +1,19 @@
+from math import pi, sin, cos
+from geometry_msgs.msg import Quaternion
+
+# Rotation by -pi/2 around the y-axis (x, y, z, w).
+# Turns the arrow of a marker (x-axis) into the approach direction of the gripper (z-axis).
+Q_ARROW_TO_APPROACH = (0.0, -sin(pi / 4), 0.0, cos(pi / 4))
+
+
+def approach_arrow_orientation(orientation):
+    '''Returns the orientation of an arrow marker that points along the approach direction (z-axis)
+    of a gripper pose, i.e. orientation * Q_ARROW_TO_APPROACH with the zero terms dropped.
+    orientation: geometry_msgs/Quaternion, orientation of the gripper pose
+    Returns: geometry_msgs/Quaternion
+    '''
+    _, s, _, c = Q_ARROW_TO_APPROACH
+    return Quaternion(x=c * orientation.x - s * orientation.z,
+                      y=c * orientation.y + s * orientation.w,
+                      z=c * orientation.z + s * orientation.x,
+                      w=c * orientation.w - s * orientation.y)
@@ -28,6 +28,7 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import copy
+import threading
 import moveit_commander
 import xml.etree.ElementTree as ET
 
@@ -36,6 +37,10 @@ from moveit_commander.conversions import pose_to_list
 import rospy
 from geometry_msgs.msg import Pose, PoseStamped, Point, Quaternion
 import moveit_msgs
+from moveit_msgs.msg import PlanningScene, PlanningSceneComponents, CollisionObject, AttachedCollisionObject
+from moveit_msgs.srv import ApplyPlanningScene, GetPlanningScene, GetPlanningSceneRequest
+from shape_msgs.msg import SolidPrimitive
+from std_msgs.msg import Header
 import trajectory_msgs
 
 
@@ -53,8 +58,52 @@ class MoveitWrapper:
         self.lib = {"tf": libtf}
 
         self.whole_body, self.gripper, self.scene, self.robot = self.init_moveit(planning_time) 
+        # Used to apply several collision object changes with a single planning scene diff.
+        # The service applies the diff synchronously, the topic is only used if the service is not available.
+        self.apply_planning_scene = self.connect_apply_planning_scene()
+        # Object names of the planning scene monitored by move_group, kept up to date by scene_cb.
+        # Only set up by init_scene_monitor on the first fallback, as the monitored scene also carries the octomap.
+        self.scene_cv = threading.Condition()
+        self.known_object_names = set()
+        self.attached_object_names = set()
+        self.scene_pub = None
+        self.scene_sub = None
 
     
+    def connect_apply_planning_scene(self, timeout=10.0):
+        try:
+            rospy.wait_for_service('/apply_planning_scene', timeout)
+        except rospy.ROSException:
+            rospy.logwarn("/apply_planning_scene is not available, planning scene diffs are published instead")
+            return None
+        return rospy.ServiceProxy('/apply_planning_scene', ApplyPlanningScene, persistent=True)
+
+    def init_scene_monitor(self, timeout=10.0):
+        """Set up publishing planning scene diffs and monitoring the planning scene, if not done yet.
+        Only needed if /apply_planning_scene is not available.
+
+        Args:
+            timeout (float, optional): Maximum time to wait for move_group in seconds. Defaults to 10.0.
+        """
+        if self.scene_sub is not None:
+            return
+        # The queue is not kept at 1, since dropping a diff would lose the changes in it.
+        self.scene_sub = rospy.Subscriber(
+            '/move_group/monitored_planning_scene', PlanningScene, self.scene_cb, queue_size=10, tcp_nodelay=True)
+        # Only request the object names, not the whole scene with geometry and octomap
+        rospy.wait_for_service('/get_planning_scene', timeout)
+        self.get_planning_scene = rospy.ServiceProxy('/get_planning_scene', GetPlanningScene, persistent=True)
+        self.scene_names_request = GetPlanningSceneRequest(components=PlanningSceneComponents(
+            components=PlanningSceneComponents.WORLD_OBJECT_NAMES | PlanningSceneComponents.ROBOT_STATE_ATTACHED_OBJECTS))
+        # The monitored scene only sends diffs after subscribing, so the names are queried once at the start
+        self.refresh_scene_cache()
+
+        # Messages published before move_group is connected would be lost
+        self.scene_pub = rospy.Publisher('/planning_scene', PlanningScene, queue_size=1)
+        end_time = rospy.Time.now() + rospy.Duration(timeout)
+        while self.scene_pub.get_num_connections() == 0 and rospy.Time.now() < end_time and not rospy.is_shutdown():
+            rospy.sleep(0.05)
+
     def init_moveit(self, planning_time):
         # handle non default HSR topic name :)))))))
         moveit_commander.roscpp_initialize(['joint_states:=/hsrb/joint_states'])
@@ -141,10 +190,10 @@ class MoveitWrapper:
         return self.all_close(target_pose, current_pose, pos_tolerance, ori_tolerance)
     
     def attach_object(self, object_name, touch_links=[]):
-        self.whole_body.attach_object(object_name, touch_links=touch_links)
+        return self.apply_scene_diff(attached_collision_objects=[self.make_attach(object_name, touch_links)])
 
     def detach_all_objects(self):
-        self.whole_body.detach_object()
+        return self.apply_scene_diff(attached_collision_objects=[self.make_detach()])
 
     def add_box(self, name, frame, pose, size):
         """Add a box to the planning scene.
@@ -158,15 +207,168 @@ class MoveitWrapper:
         Examples:
             add_box("box_0", "world", Point(0.0, 0.1, 0.2), (0.1, 0.1, 0.1))
         """
-        box_pose = PoseStamped()
-        box_pose.header.frame_id = frame
+        return self.apply_scene_diff([self.make_box(name, frame, pose, size)])
+
+    def make_box(self, name, frame, pose, size):
+        """Create a collision object message that adds a box to the planning scene.
+
+        Args:
+            name (str): The name of box.
+            frame (str): The name of frame.
+            pose (geometry_msgs/Point, geometry_msgs/Pose): Coordinates to add a box.
+            size (list[float]): The size of box. The size is given as a (x, y, z).
+
+        Returns:
+            moveit_msgs/CollisionObject: The collision object, see apply_scene_diff.
+        """
         if isinstance(pose, Point):
-            box_pose.pose = Pose(position=pose, orientation=Quaternion(0, 0, 0, 1))
-        elif isinstance(pose, Pose):
-            box_pose.pose = pose
-        self.scene.add_box(name, box_pose, size=size)
+            pose = Pose(position=pose, orientation=Quaternion(w=1))
+        return CollisionObject(
+            header=Header(frame_id=frame), id=name, operation=CollisionObject.ADD, pose=pose,
+            primitives=[SolidPrimitive(type=SolidPrimitive.BOX, dimensions=list(size))],
+            primitive_poses=[Pose(orientation=Quaternion(w=1))])
 
-        return
+    def make_remove(self, name):
+        """Create a collision object message that removes an object from the planning scene.
+
+        Args:
+            name (str): The name of the object.
+
+        Returns:
+            moveit_msgs/CollisionObject: The collision object, see apply_scene_diff.
+        """
+        return CollisionObject(id=name, operation=CollisionObject.REMOVE)
+
+    def make_attach(self, name, touch_links=[]):
+        """Create a message that attaches an object of the planning scene to the end effector.
+
+        Args:
+            name (str): The name of the object.
+            touch_links (list[str], optional): Links that are allowed to touch the object.
+                Defaults to the end effector link.
+
+        Returns:
+            moveit_msgs/AttachedCollisionObject: The attached collision object, see apply_scene_diff.
+        """
+        link_name = self.whole_body.get_end_effector_link()
+        return AttachedCollisionObject(
+            link_name=link_name, object=CollisionObject(id=name, operation=CollisionObject.ADD),
+            touch_links=list(touch_links) or [link_name])
+
+    def make_detach(self, name=''):
+        """Create a message that detaches an object and puts it back into the planning scene.
+
+        Args:
+            name (str, optional): The name of the object. Detaches all objects if empty. Defaults to ''.
+
+        Returns:
+            moveit_msgs/AttachedCollisionObject: The attached collision object, see apply_scene_diff.
+        """
+        return AttachedCollisionObject(object=CollisionObject(id=name, operation=CollisionObject.REMOVE))
+
+    def apply_scene_diff(self, collision_objects=[], attached_collision_objects=[], timeout=4.0):
+        """Add, remove, attach and detach several objects with a single planning scene diff.
+        The diff is applied with one call of /apply_planning_scene, whose response confirms it.
+        If the service is not available, the diff is published and this waits once until
+        the planning scene reflects all of the changes.
+
+        Args:
+            collision_objects (list[moveit_msgs/CollisionObject], optional): Objects to add or remove,
+                see make_box and make_remove.
+            attached_collision_objects (list[moveit_msgs/AttachedCollisionObject], optional): Objects to attach or detach,
+                see make_attach and make_detach.
+            timeout (float, optional): Maximum time to wait for the planning scene in seconds. Defaults to 4.0.
+
+        Returns:
+            bool: Return True if all changes were applied (before the timeout).
+        """
+        diff = PlanningScene()
+        diff.is_diff = True
+        diff.robot_state.is_diff = True
+        diff.world.collision_objects = list(collision_objects)
+        diff.robot_state.attached_collision_objects = list(attached_collision_objects)
+
+        if self.apply_planning_scene is not None:
+            try:
+                return self.apply_planning_scene(diff).success
+            except rospy.ROSException as e:
+                rospy.logwarn(f"Applying planning scene diff failed: {e}. Publishing it instead.")
+                # A persistent proxy keeps its broken connection, the next call uses a new one
+                self.apply_planning_scene.close()
+                self.apply_planning_scene = rospy.ServiceProxy(
+                    '/apply_planning_scene', ApplyPlanningScene, persistent=True)
+
+        self.init_scene_monitor()
+        known = {obj.id for obj in collision_objects if obj.operation == CollisionObject.ADD}
+        removed = {obj.id for obj in collision_objects if obj.operation == CollisionObject.REMOVE}
+        attached = set()
+        detached = set()
+        for aco in attached_collision_objects:
+            if aco.object.operation == CollisionObject.ADD:
+                attached.add(aco.object.id)
+            elif aco.object.id:
+                detached.add(aco.object.id)
+            else:
+                with self.scene_cv:
+                    detached.update(self.attached_object_names)
+        # Detached objects are put back into the world, attached objects are removed from it
+        known |= detached
+        removed |= attached
+
+        self.scene_pub.publish(diff)
+        return self.wait_for_scene_update(known, removed, attached, detached, timeout)
+
+    def scene_cb(self, scene):
+        """Update the known and attached object names from a (diff) message of the monitored planning scene.
+
+        Args:
+            scene (moveit_msgs/PlanningScene): The planning scene or planning scene diff.
+        """
+        with self.scene_cv:
+            update_names(self.known_object_names, scene.world.collision_objects, scene.is_diff)
+            attached_objects = [aco.object for aco in scene.robot_state.attached_collision_objects]
+            update_names(self.attached_object_names, attached_objects, scene.is_diff and scene.robot_state.is_diff)
+            self.scene_cv.notify_all()
+
+    def refresh_scene_cache(self):
+        """Query the known and attached object names from move_group once and replace the cached names with them."""
+        scene = self.get_planning_scene(self.scene_names_request).scene
+        known_names = {obj.id for obj in scene.world.collision_objects}
+        attached_names = {aco.object.id for aco in scene.robot_state.attached_collision_objects}
+        with self.scene_cv:
+            self.known_object_names = known_names
+            self.attached_object_names = attached_names
+            self.scene_cv.notify_all()
+
+    def wait_for_scene_update(self, known=set(), removed=set(), attached=set(), detached=set(), timeout=4.0):
+        """Wait until all objects in known are in the planning scene and none of the objects in removed,
+        and until all objects in attached are attached to the robot and none of the objects in detached.
+        Waits on the updates of the monitored planning scene instead of polling move_group.
+
+        Args:
+            known (set[str], optional): Names of objects that should be in the planning scene.
+            removed (set[str], optional): Names of objects that should not be in the planning scene.
+            attached (set[str], optional): Names of objects that should be attached to the robot.
+            detached (set[str], optional): Names of objects that should not be attached to the robot.
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to 4.0.
+
+        Returns:
+            bool: Return True if the planning scene was updated before the timeout.
+        """
+        def is_updated():
+            return (known <= self.known_object_names and not removed & self.known_object_names
+                    and attached <= self.attached_object_names and not detached & self.attached_object_names)
+
+        with self.scene_cv:
+            if self.scene_cv.wait_for(is_updated, timeout):
+                return True
+        # A diff of the monitored scene might have been dropped, check once against move_group itself
+        self.refresh_scene_cache()
+        with self.scene_cv:
+            if is_updated():
+                return True
+        rospy.logwarn(f"Timeout while waiting for planning scene update of {sorted(known | removed | attached | detached)}")
+        return False
 
     def add_cylinder(self, name, frame, pose, height, radius):
         """Add a cylinder to the planning scene.
@@ -474,4 +676,22 @@ class MoveitWrapper:
         base_pose = self.lib['tf'].transform_pose(frame, p)
         return base_pose
 
-        
\ No newline at end of file
+
+def update_names(names, collision_objects, is_diff):
+    """Apply the operations of collision object messages to a set of object names.
+
+    Args:
+        names (set[str]): The object names, updated in place.
+        collision_objects (list[moveit_msgs/CollisionObject]): The collision objects of a planning scene (diff).
+        is_diff (bool): If False, the collision objects are the complete list of objects.
+    """
+    if not is_diff:
+        names.clear()
+    for obj in collision_objects:
+        if obj.operation != CollisionObject.REMOVE:
+            names.add(obj.id)
+        elif obj.id:
+            names.discard(obj.id)
+        else:
+            # Removing an object without name removes all objects
+            names.clear()
@@ -1,5 +1,4 @@
 #! /usr/bin/env python3
-from math import pi
 from copy import deepcopy
 import numpy as np
 import rospy
@@ -9,6 +8,7 @@ import tf
 import tf.transformations
 from moveit_wrapper import MoveitWrapper
 from hsr_wrapper import HSR_wrapper
+from marker_utils import approach_arrow_orientation
 from v4r_util.tf2 import TF2Wrapper
 from v4r_util.conversions import bounding_box_to_bounding_box_stamped, list_to_vector3, vector3_to_list, rot_mat_to_quat, quat_to_rot_mat, np_transform_to_ros_transform, np_transform_to_ros_pose
 from v4r_util.util import ros_bb_to_o3d_bb, align_bounding_box_rotation
@@ -29,10 +29,14 @@ class PlaceObjectServer():
         self.moveit = MoveitWrapper(self.tf2_wrapper, planning_time=10.0)
         self.hsr_wrapper = HSR_wrapper()
 
+        self.bb_vis = RvizVisualizer('grasping_pipeline/placement_debug_bb')
+        self.tf_broadcaster = tf.TransformBroadcaster()
+        self.marker_pub = rospy.Publisher(
+            '/grasping_pipeline/placement_marker', Marker, queue_size=100, latch=True)
+
         self.server = actionlib.SimpleActionServer(
             'place_object', PlaceAction, self.execute, False)
         self.server.start()
-        self.bb_vis = RvizVisualizer('grasping_pipeline/placement_debug_bb')
 
         rospy.loginfo("Init Placement")
     
@@ -73,7 +77,6 @@ class PlaceObjectServer():
         target_bb.center.orientation = Quaternion(x=0, y=0, z=0, w=1)
         header = Header(stamp=rospy.Time.now(), frame_id=placement_area_det_frame)
         self.bb_vis.publish_ros_bb(target_bb, header, "target_bb")
-        rospy.sleep(0.05)
 
         target_point = target_bb.center.position
         box_filter_range = target_bb.size
@@ -117,7 +120,7 @@ class PlaceObjectServer():
         
         return obj_bb_map_frame_aligned
     
-    def call_placement_area_detector(self, obj_bb_aligned, placement_area_det_frame, target_point, box_filter_range):
+    def call_placement_area_detector(self, obj_bb_aligned, placement_area_det_frame, target_point, box_filter_range, max_failed_calls=5):
         vertical_axis = Vector3()
         vertical_axis.x = 0.0
         vertical_axis.y = 0.0
@@ -144,8 +147,11 @@ class PlaceObjectServer():
         surface_range = 1.0
 
         rospy.wait_for_service('detect_placement_area')
+        detect_placement_area = rospy.ServiceProxy(
+            'detect_placement_area', DetectPlacementArea)
 
-        while True:
+        failed_calls = 0
+        while not rospy.is_shutdown():
             try:
                 # Toyota Detect Placement Area Service:
                 # frame: everything (points and x,y,z axis) are relative to this frame
@@ -160,12 +166,16 @@ class PlaceObjectServer():
                 # basically post-processing transformation of the point that their algorithm normally returns
                 # for translation just does an addition at the end to translate pose, doesn't check wether this pose is free
                 # surface_range: I ran valuse from 1E22 to 1E-22, always same behaviour unless range was zero, then it did nothing
-                detect_placement_area = rospy.ServiceProxy(
-                    'detect_placement_area', DetectPlacementArea)
                 response = detect_placement_area(placement_area_det_frame, target_point, box_filter_range, vertical_axis,
                                                 tilt_threshold, distance_threshold, object_shape, object_to_surface, surface_range)
             except rospy.ServiceException as e:
-                print("DetectPlacmentAreaService call failed: %s" % e)
+                failed_calls += 1
+                print("DetectPlacmentAreaService call failed (%d/%d): %s" % (failed_calls, max_failed_calls, e))
+                if failed_calls >= max_failed_calls:
+                    raise
+                # There is no (new) response to check, retry the call after a short pause
+                rospy.sleep(0.5)
+                continue
 
             if response.error_code.val == 1:
                 return response.placement_area
@@ -183,6 +193,14 @@ class PlaceObjectServer():
                 print("ErrorCode: NON_POSITIVE")
             elif response.error_code.val == -1:
                 print("ErrorCode: ZERO_VECTOR")
+            # Failed detections count towards the retry limit as well, otherwise a scene without
+            # an acceptable plane would be retried forever
+            failed_calls += 1
+            if failed_calls >= max_failed_calls:
+                raise rospy.ServiceException(
+                    f"DetectPlacementArea failed {failed_calls} times, last error code: {response.error_code.val}")
+            rospy.sleep(0.5)
+        raise rospy.ROSInterruptException('Shutdown while detecting placement areas')
     
     def test_bb_plane_intersection(self, bb_pts, plane):
         '''Check if the bounding box intersects with the plane
@@ -256,7 +274,8 @@ class PlaceObjectServer():
             return
 
         table_bb = goal.table_bbs.boxes[table_idx]
-        self.moveit.add_box('placement_table', goal.table_bbs.header.frame_id, table_bb.center, vector3_to_list(table_bb.size))
+        if not self.moveit.add_box('placement_table', goal.table_bbs.header.frame_id, table_bb.center, vector3_to_list(table_bb.size)):
+            rospy.logerr("Placement: Adding the placement table to the planning scene failed")
 
         table_equation = goal.table_plane_equations[table_idx]
         table_bb_stamped = bounding_box_to_bounding_box_stamped(table_bb, goal.table_bbs.header.frame_id, rospy.Time.now())
@@ -277,8 +296,6 @@ class PlaceObjectServer():
             placement_point = self.tf2_wrapper.transform_pose(base_frame, placement_point)
             placement_point.pose.orientation = quat
             self.add_marker(placement_point, 5000000, 0, 0, 1)
-            
-            rospy.sleep(0.02)
 
             safety_distance = min(0.01 + i/100, 0.04)
             safety_distance = np.random.uniform(0.01, 0.05)
@@ -312,7 +329,6 @@ class PlaceObjectServer():
                 g = 1
                 b = 1
                 self.add_marker(waypoint, i+7000, r, g, b)           
-                rospy.sleep(0.02)
 
             plan_found = self.moveit.whole_body_plan_and_go(waypoints_tr[0])
             if not plan_found:
@@ -340,16 +356,14 @@ class PlaceObjectServer():
             self.server.set_aborted()
     
     def add_marker(self, pose_goal, id=0, r=0, g=1, b=0):
-        br = tf.TransformBroadcaster()
-        br.sendTransform((pose_goal.pose.position.x, pose_goal.pose.position.y, pose_goal.pose.position.z),
-                         [pose_goal.pose.orientation.x, pose_goal.pose.orientation.y,
-                             pose_goal.pose.orientation.z, pose_goal.pose.orientation.w],
-                         rospy.Time.now(),
-                         'grasp_pose_execute',
-                         pose_goal.header.frame_id)
-
-        marker_pub = rospy.Publisher(
-            '/grasping_pipeline/placement_marker', Marker, queue_size=100, latch=True)
+        self.tf_broadcaster.sendTransform(
+            (pose_goal.pose.position.x, pose_goal.pose.position.y, pose_goal.pose.position.z),
+            [pose_goal.pose.orientation.x, pose_goal.pose.orientation.y,
+                pose_goal.pose.orientation.z, pose_goal.pose.orientation.w],
+            rospy.Time.now(),
+            'grasp_pose_execute',
+            pose_goal.header.frame_id)
+
         marker = Marker()
         marker.header.frame_id = pose_goal.header.frame_id
         marker.header.stamp = rospy.Time()
@@ -359,15 +373,7 @@ class PlaceObjectServer():
         marker.type = Marker.ARROW
         marker.action = Marker.ADD
 
-        q2 = [pose_goal.pose.orientation.w, pose_goal.pose.orientation.x,
-              pose_goal.pose.orientation.y, pose_goal.pose.orientation.z]
-        q = tf.transformations.quaternion_about_axis(pi / 2, (0, 1, 0))
-        q = tf.transformations.quaternion_multiply(q, q2)
-
-        marker.pose.orientation.w = q[0]
-        marker.pose.orientation.x = q[1]
-        marker.pose.orientation.y = q[2]
-        marker.pose.orientation.z = q[3]
+        marker.pose.orientation = approach_arrow_orientation(pose_goal.pose.orientation)
         marker.pose.position.x = pose_goal.pose.position.x
         marker.pose.position.y = pose_goal.pose.position.y
         marker.pose.position.z = pose_goal.pose.position.z
@@ -380,7 +386,7 @@ class PlaceObjectServer():
         marker.color.r = r
         marker.color.g = g
         marker.color.b = b
-        marker_pub.publish(marker)
+        self.marker_pub.publish(marker)
 
 
 if __name__ == '__main__':
@@ -7,7 +7,6 @@ from states.userinput import UserInput
 from states.robot_control import GoToNeutral, OpenGripper, GoToWaypoint, GoToAndLookAtPlacementArea, GoBack
 from states.find_table_planes import FindTablePlanes
 from grasping_pipeline_msgs.msg import FindGrasppointAction, ExecuteGraspAction
-from handover.msg import HandoverAction
 from grasping_pipeline_msgs.msg import PlaceAction
 
 
@@ -53,7 +52,9 @@ def create_statemachine(enable_userinput=True, do_handover=True):
         smach.Sequence.add('GO_TO_TABLE_AFTER_GRASP', table_waypoint, 
                            transitions={'aborted': 'GO_TO_TABLE_AFTER_GRASP'})
 
+        # Only import the handover messages if they are used, so that the handover package isn't needed otherwise
         if do_handover:
+            from handover.msg import HandoverAction
             smach.Sequence.add('HANDOVER', smach_ros.SimpleActionState('/handover', HandoverAction),
                                transitions={'succeeded': 'GO_TO_NEUTRAL',
                                             'preempted': 'GO_TO_NEUTRAL',
@@ -93,3 +94,8 @@ if __name__ == '__main__':
         sis.stop()
     except rospy.ROSInterruptException:
         pass
+    except smach.InvalidUserCodeError:
+        # smach wraps exceptions raised by states, e.g. the ROSInterruptException
+        # of UserInput when shutting down while waiting for input
+        if not rospy.is_shutdown():
+            raise
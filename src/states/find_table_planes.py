@@ -1,3 +1,5 @@
+import threading
+import numpy as np
 import rospy
 import smach
 from sensor_msgs.msg import PointCloud2
@@ -6,26 +8,87 @@ from v4r_util.tf2 import TF2Wrapper
 from v4r_util.conversions import bounding_box_to_bounding_box_stamped
 from v4r_util.util import align_bounding_box_rotation, ros_bb_to_o3d_bb, o3d_bb_to_ros_bb
 
+_cloud_listeners = {}
+
+
+class CloudListener:
+    '''Point cloud subscriber that is only registered while waiting for a cloud,
+    so that the full rate point cloud stream is not received and deserialized while no cloud is needed.'''
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.cloud = None
+        self.cloud_received = threading.Event()
+
+    def cloud_cb(self, cloud):
+        self.cloud = cloud
+        self.cloud_received.set()
+
+    def wait_for_cloud(self, timeout):
+        '''Waits for the next point cloud that arrives after this call.
+        This ensures that the cloud shows the current scene and not the scene before the robot moved.
+        timeout: timeout in seconds
+        Returns: sensor_msgs/PointCloud2
+        '''
+        self.cloud_received.clear()
+        # Point clouds are several MB, so disable Nagle's algorithm and use a receive buffer that fits a whole cloud
+        cloud_sub = rospy.Subscriber(
+            self.topic, PointCloud2, self.cloud_cb, queue_size=1, tcp_nodelay=True, buff_size=2**25)
+        try:
+            if not self.cloud_received.wait(timeout):
+                raise rospy.ROSException(f'Timeout while waiting for point cloud on {self.topic}')
+        finally:
+            cloud_sub.unregister()
+        return self.cloud
+
+
+def get_cloud_listener(topic):
+    '''Returns the CloudListener of the topic that is shared by all states of this process.
+    '''
+    if topic not in _cloud_listeners:
+        _cloud_listeners[topic] = CloudListener(topic)
+    return _cloud_listeners[topic]
+
+
 class FindTablePlanes(smach.State):
 
-    def __init__(self, enlarge_table_bb_to_floor=True):
+    def __init__(self, enlarge_table_bb_to_floor=True, min_table_height=0.2):
         smach.State.__init__(
             self, outcomes=['succeeded'], output_keys=['table_bbs', 'table_plane_equations'])
         self.topic = rospy.get_param('/point_cloud_topic')
         self.table_extractor_srv_name = '/table_plane_extractor/get_planes'
         self.table_extractor = rospy.ServiceProxy(
-            self.table_extractor_srv_name, TablePlaneExtractor)
+            self.table_extractor_srv_name, TablePlaneExtractor, persistent=True)
+        self.table_extractor_available = False
         self.tf_wrapper = TF2Wrapper()
         self.enlarge_table_bb_to_floor = enlarge_table_bb_to_floor
+        # Planes below this height (in base_link) are not considered to be tables
+        self.min_table_height = min_table_height
+        self.cloud_listener = get_cloud_listener(self.topic)
+
+    def call_table_extractor(self, cloud, timeout=5):
+        try:
+            return self.table_extractor(cloud)
+        except rospy.ROSException as e:
+            # ServiceException and transport errors of the persistent connection, e.g. after the service restarted.
+            # The broken connection has to be replaced by a new proxy.
+            rospy.logwarn(f'Table plane extractor call failed: {e}. Reconnecting.')
+            self.table_extractor.close()
+            rospy.wait_for_service(self.table_extractor_srv_name, timeout)
+            self.table_extractor = rospy.ServiceProxy(
+                self.table_extractor_srv_name, TablePlaneExtractor, persistent=True)
+            return self.table_extractor(cloud)
 
     def execute(self, userdata):
         rospy.loginfo('Executing state FIND_TABLE_PLANES. Waiting for point cloud.')
-        cloud = rospy.wait_for_message(self.topic, PointCloud2, timeout=15)
-        rospy.loginfo('Received point cloud. Waiting for table plane extractor service.')
-        rospy.wait_for_service(self.table_extractor_srv_name)
-        rospy.loginfo('Service available. Calling table plane extractor.')
+        cloud = self.cloud_listener.wait_for_cloud(timeout=15)
+        if not self.table_extractor_available:
+            rospy.loginfo('Received point cloud. Waiting for table plane extractor service.')
+            rospy.wait_for_service(self.table_extractor_srv_name)
+            self.table_extractor_available = True
+        rospy.loginfo('Calling table plane extractor.')
         
-        response = self.table_extractor(cloud)
+        response = self.call_table_extractor(cloud)
         boxes = response.plane_bounding_boxes
         
         if self.enlarge_table_bb_to_floor:
@@ -33,26 +96,38 @@ class FindTablePlanes(smach.State):
             if boxes.header.frame_id != 'base_link':
                 transform_to_base = True
 
-            new_boxes = []
+            base_boxes = []
             for ros_bb in boxes.boxes:
                 if transform_to_base:
                     ros_bb = bounding_box_to_bounding_box_stamped(ros_bb, boxes.header.frame_id , rospy.Time.now())
                     ros_bb = self.tf_wrapper.transform_bounding_box(ros_bb, 'base_link')
-                
-                aligned_bb_o3d = align_bounding_box_rotation(ros_bb_to_o3d_bb(ros_bb))
-                ros_bb = o3d_bb_to_ros_bb(aligned_bb_o3d)
-
-                center = ros_bb.center.position
-                old_center_z = center.z
-                size = ros_bb.size
-                center.z = (center.z + size.z/2)/2
-                size.x = size.x + 0.04
-                size.y = size.y + 0.04
-                size.z = old_center_z + size.z/2 - 0.02
-                new_boxes.append(ros_bb)
+                base_boxes.append(ros_bb)
+
+            # Cull floor-level planes in one go, before doing the per box work.
+            # They can't be enlarged to the floor and would end up with a non-positive height.
+            centers_z = np.array([ros_bb.center.position.z for ros_bb in base_boxes])
+            table_indices = np.flatnonzero(centers_z >= self.min_table_height)
+            if len(table_indices) < len(base_boxes):
+                rospy.loginfo(f'Ignoring {len(base_boxes) - len(table_indices)} planes below {self.min_table_height} m')
+
+            new_boxes = [o3d_bb_to_ros_bb(align_bounding_box_rotation(ros_bb_to_o3d_bb(base_boxes[i])))
+                         for i in table_indices]
+
+            # Enlarge all boxes to the floor at once and only write the results back per box
+            dims = np.array([(bb.center.position.z, bb.size.x, bb.size.y, bb.size.z) for bb in new_boxes]).reshape(-1, 4)
+            center_z, size_x, size_y, size_z = dims.T
+            top_z = center_z + size_z/2
+            new_dims = np.column_stack((top_z/2, size_x + 0.04, size_y + 0.04, top_z - 0.02))
+            for ros_bb, (new_center_z, new_size_x, new_size_y, new_size_z) in zip(new_boxes, new_dims.tolist()):
+                ros_bb.center.position.z = new_center_z
+                ros_bb.size.x = new_size_x
+                ros_bb.size.y = new_size_y
+                ros_bb.size.z = new_size_z
 
             response.plane_bounding_boxes.boxes = new_boxes
             response.plane_bounding_boxes.header.frame_id = 'base_link'
+            # Keep plane equations and boxes index-aligned
+            response.planes = [response.planes[i] for i in table_indices]
 
         userdata.table_bbs = response.plane_bounding_boxes
         userdata.table_plane_equations = response.planes
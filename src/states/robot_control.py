@@ -7,6 +7,18 @@ from move_base_msgs.msg import MoveBaseAction, MoveBaseGoal
 from hsrb_interface import Robot
 from grasping_pipeline_msgs.msg import BoundingBox3DStamped
 
+_robot = None
+
+
+def get_robot():
+    '''Returns the hsrb_interface Robot that is shared by all states of this process,
+    so that every state doesn't open its own connection.
+    '''
+    global _robot
+    if _robot is None:
+        _robot = Robot()
+    return _robot
+
 
 class GoToNeutral(smach.State):
     """ Smach state that will move the robots joints to a
@@ -18,7 +30,7 @@ class GoToNeutral(smach.State):
     def __init__(self):
         smach.State.__init__(self, outcomes=['succeeded'])
         # Robot initialization
-        self.robot = Robot()
+        self.robot = get_robot()
         self.whole_body = self.robot.try_get('whole_body')
 
     def execute(self, userdata):
@@ -47,7 +59,7 @@ class MoveToJointPositions(smach.State):
     def __init__(self, joint_positions_dict):
         smach.State.__init__(self, outcomes=['succeeded'])
         # Robot initialization
-        self.robot = Robot()
+        self.robot = get_robot()
         self.whole_body = self.robot.try_get('whole_body')
         self.joint_positions_dict = joint_positions_dict
 
@@ -67,7 +79,7 @@ class GoBack(smach.State):
     def __init__(self, distance):
         smach.State.__init__(self, outcomes=['succeeded'])
         # Robot initialization
-        self.robot = Robot()
+        self.robot = get_robot()
         self.base = self.robot.try_get('omni_base')
         self.whole_body = self.robot.try_get('whole_body')
         self.distance = distance
@@ -89,7 +101,7 @@ class OpenGripper(smach.State):
         smach.State.__init__(self, outcomes=['succeeded'])
 
         # Robot initialization
-        self.robot = Robot()
+        self.robot = get_robot()
         self.gripper = self.robot.try_get('gripper')
 
     def execute(self, userdata):
@@ -107,7 +119,7 @@ class GoToWaypoint(smach.State):
         smach.State.__init__(self, outcomes=['succeeded', 'aborted'])
         self.move_client = actionlib.SimpleActionClient(
             '/move_base/move', MoveBaseAction)
-        self.robot = Robot()
+        self.robot = get_robot()
         self.whole_body = self.robot.try_get('whole_body')
         self.x = x
         self.y = y
@@ -153,7 +165,7 @@ class GoToAndLookAtPlacementArea(smach.State):
         smach.State.__init__(self, outcomes=outcomes, input_keys=input_keys, output_keys=output_keys)
         self.move_client = actionlib.SimpleActionClient(
             '/move_base/move', MoveBaseAction)
-        self.robot = Robot()
+        self.robot = get_robot()
         self.whole_body = self.robot.try_get('whole_body')
         self.timeout = 40.0
     
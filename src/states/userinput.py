@@ -1,3 +1,5 @@
+import sys
+import select
 import smach
 import rospy
 
@@ -38,17 +40,38 @@ class UserInput(smach.State):
         for key in self.map:
             print('\t' + str(key) + ' - ' + str(self.map[key][1]))
 
+    def read_char(self):
+        '''Reads one line from stdin. Polls stdin instead of blocking in input(),
+        so that a ROS shutdown is noticed while waiting for the user.
+        Returns: the lowercase character if the line (ignoring surrounding whitespace)
+        is a single character, else None
+        '''
+        print('CMD> ', end='', flush=True)
+        while not rospy.is_shutdown():
+            ready, _, _ = select.select([sys.stdin], [], [], 0.1)
+            if ready:
+                break
+        else:
+            raise rospy.ROSInterruptException('Shutdown while waiting for user input')
+        line = sys.stdin.readline()
+        if line == '':
+            raise EOFError('stdin was closed')
+        user_input = line.strip().lower()
+        if len(user_input) != 1:
+            return None
+        return user_input
+
     def handle_userinput(self):
         while True:
-            user_input = input('CMD> ')
-            if len(user_input) != 1:
+            char_input = self.read_char()
+            if char_input is None:
                 print('Please enter only one character')
                 continue
-            char_input = user_input.lower()
-            if char_input not in self.map:
+            entry = self.map.get(char_input)
+            if entry is None:
                 print('Invalid key!')
                 continue
-            return self.map[char_input][0]
+            return entry[0]
 
 
 if __name__ == '__main__':
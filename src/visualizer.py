@@ -1,7 +1,6 @@
 #! /usr/bin/env python3
 import os
 import sys
-import copy
 import rospy
 import ros_numpy
 import open3d as o3d
@@ -66,7 +65,10 @@ class PoseEstimationVisualizerRos(PoseEstimationVisualizer):
             if mesh is None and name != 'Unknown':
                 rospy.logwarn(f'No mesh for model {name} found!')
                 continue
-            meshes.append(copy.deepcopy(mesh))
+            if mesh is not None:
+                # Open3D copy constructor, cheaper than copy.deepcopy
+                mesh = o3d.geometry.TriangleMesh(mesh)
+            meshes.append(mesh)
 
         try:
             self.publish_pose_estimation_result(